@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "services.middleware.ProfilingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -138,6 +139,33 @@ CORS_ALLOW_ALL_ORIGINS = True
 
 CORS_ALLOW_ALL_HEADERS = True
 CORS_ALLOW_METHODS = ["GET", "POST", "PUT", "DELETE", "OPTIONS"]
+CORS_EXPOSE_HEADERS = [
+    "X-Bulk-Job-Id", "X-Bulk-Queue-Wait-Avg-Ms", "X-Bulk-Queue-Wait-Max-Ms", "X-Bulk-Producer-Blocked-Ms",
+    "X-Bulk-Summary", "X-Profile-Id",
+]
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
+
+# Shared bulk scheduler: worker threads for the whole process and rows buffered per upload
+BULK_MAX_WORKERS = 64
+BULK_MAX_PENDING_PER_JOB = 500
+
+# Keep shipping_rollups updated as quotes are saved, for the analytics endpoint's rollup source
+ANALYTICS_ROLLUPS_ENABLED = True
+
+# Address documents kept in each process's id resolution cache
+ADDRESS_CACHE_SIZE = 10000
+
+# Per-request profiling: send "X-Profile: <PROFILING_TOKEN>" or set a sample rate between 0 and 1.
+# Profiles are written to PROFILING_DIR, or to the request_profiles collection with PROFILING_STORAGE = "mongo".
+PROFILING_TOKEN = os.environ.get("PROFILING_TOKEN")
+PROFILING_SAMPLE_RATE = float(os.environ.get("PROFILING_SAMPLE_RATE", "0"))
+PROFILING_INTERVAL = 0.005
+PROFILING_MAX_EVENTS = 1000
+PROFILING_MAX_STACKS = 500
+PROFILING_STORAGE = "directory"
+PROFILING_DIR = os.path.join(BASE_DIR, 'profiles')
+
+# Most labels_zip/ accepts as an explicit label_urls or record_ids list
+LABELS_ZIP_MAX_ENTRIES = 5000
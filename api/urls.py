@@ -1,5 +1,5 @@
 from django.urls import path
-from services.views import login, registration, validate_address, get_shipping_rate, bulk_shipping_rate_calculation, all_details
+from services.views import login, registration, validate_address, get_shipping_rate, bulk_shipping_rate_calculation, bulk_summary, labels_zip, all_details, shipping_analytics
 
 
 urlpatterns = [
@@ -8,5 +8,8 @@ urlpatterns = [
     path("validate_address/", validate_address),
     path("get_shipping/", get_shipping_rate),
     path("bulk_calculate/", bulk_shipping_rate_calculation),
+    path("bulk_summary/<str:job_id>/", bulk_summary),
+    path("labels_zip/", labels_zip),
     path("all_details/", all_details),
+    path("analytics/", shipping_analytics),
 ]
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from services.utils.mongo import get_mongo_db
+from services.utils.analytics import ensure_analytics_indexes
+
+
+class Command(BaseCommand):
+    help = "Create the shipping_costs and shipping_rollups indexes used by the analytics endpoint."
+
+    def handle(self, *args, **options):
+        ensure_analytics_indexes(get_mongo_db())
+        self.stdout.write(self.style.SUCCESS("Analytics indexes created."))
@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+from pymongo import UpdateOne
+from services.utils.mongo import get_mongo_db
+from services.utils.addresses import ensure_address_indexes, save_addresses
+from services.utils.analytics import lane_key
+
+
+class Command(BaseCommand):
+    help = "Move embedded sender/receiver documents in shipping_costs into the addresses collection."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        db = get_mongo_db()
+        collection = db["shipping_costs"]
+        batch_size = options["batch_size"]
+        migrated = 0
+
+        cursor = collection.find(
+            {"sender": {"$type": "object"}, "receiver": {"$type": "object"}},
+            {"sender": 1, "receiver": 1},
+            batch_size=batch_size,
+        )
+        batch = []
+        for record in cursor:
+            batch.append(record)
+            if len(batch) >= batch_size:
+                migrated += self._migrate_batch(db, batch)
+                batch = []
+        if batch:
+            migrated += self._migrate_batch(db, batch)
+
+        ensure_address_indexes(db)
+
+        self.stdout.write(self.style.SUCCESS(f"Migrated {migrated} shipping_costs records."))
+        skipped = collection.count_documents({"$or": [{"sender": {"$exists": True}}, {"receiver": {"$exists": True}}]})
+        if skipped:
+            self.stdout.write(self.style.WARNING(f"Skipped {skipped} records without sender and receiver documents."))
+
+    def _migrate_batch(self, db, batch):
+        sender_ids = save_addresses(db, [record["sender"] for record in batch])
+        receiver_ids = save_addresses(db, [record["receiver"] for record in batch])
+        operations = [
+            UpdateOne({"_id": record["_id"]}, {
+                "$set": {
+                    "sender_id": sender_id,
+                    "receiver_id": receiver_id,
+                    "lane": lane_key(record["sender"], record["receiver"]),
+                },
+                "$unset": {"sender": "", "receiver": ""},
+            })
+            for record, sender_id, receiver_id in zip(batch, sender_ids, receiver_ids)
+        ]
+        db["shipping_costs"].bulk_write(operations, ordered=False)
+        return len(operations)
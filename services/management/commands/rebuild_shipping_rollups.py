@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from services.utils.mongo import get_mongo_db
+from services.utils.analytics import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute the shipping_rollups documents from shipping_costs."
+
+    def handle(self, *args, **options):
+        rebuild_rollups(get_mongo_db())
+        self.stdout.write(self.style.SUCCESS("Shipping rollups rebuilt."))
@@ -0,0 +1,63 @@
+from django.conf import settings
+from datetime import datetime
+from .utils.profiling import RequestProfile, SamplingProfiler, activate_profile, deactivate_profile, save_profile
+import hmac
+import random
+import time
+import uuid
+
+
+# Profiles a request when the caller sends X-Profile with PROFILING_TOKEN, or when it
+# falls within PROFILING_SAMPLE_RATE. The profile id is returned in X-Profile-Id.
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def _trigger(self, request):
+        token = getattr(settings, "PROFILING_TOKEN", None)
+        header = request.headers.get("X-Profile")
+        # Compared as bytes, since compare_digest rejects non-ASCII str
+        if token and header and hmac.compare_digest(header.encode("utf-8"), token.encode("utf-8")):
+            return "header"
+        sample_rate = getattr(settings, "PROFILING_SAMPLE_RATE", 0.0)
+        if sample_rate and random.random() < sample_rate:
+            return "sample"
+        return None
+
+    def __call__(self, request):
+        trigger = self._trigger(request)
+        if trigger is None:
+            return self.get_response(request)
+
+        profile = RequestProfile(str(uuid.uuid4()), getattr(settings, "PROFILING_MAX_EVENTS", 1000))
+        sampler = SamplingProfiler(profile, getattr(settings, "PROFILING_INTERVAL", 0.005),
+                                   getattr(settings, "PROFILING_MAX_STACKS", 500))
+        started_at = datetime.now()
+        context_token = activate_profile(profile)
+        sampler.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            sampler.stop()
+            deactivate_profile(context_token)
+
+        duration_ms = round((time.perf_counter() - profile.started_at) * 1000, 3)
+        try:
+            save_profile({
+                "profile_id": profile.profile_id,
+                "trigger": trigger,
+                "method": request.method,
+                "path": request.path,
+                "status": response.status_code,
+                "started_at": started_at,
+                "duration_ms": duration_ms,
+                "cpu_samples": sampler.result(),
+                "mongo": profile.mongo.result(),
+                "carrier": profile.carrier.result(),
+            })
+        except Exception as e:
+            print(f"Error while saving profile {profile.profile_id}: {e}")
+            return response
+
+        response["X-Profile-Id"] = profile.profile_id
+        return response
@@ -1,3 +1,278 @@
-from django.test import TestCase
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.http import HttpResponse, QueryDict
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from rest_framework.test import APIRequestFactory
+from datetime import datetime
+import csv
+import gzip
+import threading
+import time
 
-# Create your tests here.
+from .middleware import ProfilingMiddleware
+from .utils.addresses import address_id, normalize_address, resolve_addresses, save_address
+from .utils.analytics import _created_at_match, _group_keys, lane_key, rollup_summary, update_rollups
+from .utils.bulk_io import UPLOAD_DECODE_ERRORS, _fieldnames, open_csv_upload
+from .utils.label_zip import label_path
+from .utils.profiling import RequestProfile, SamplingProfiler, Timeline, activate_profile, deactivate_profile
+from .utils.scheduler import BulkScheduler
+from .views import _string_list, labels_zip, shipping_analytics
+
+
+class BulkSchedulerTests(SimpleTestCase):
+    def test_results_keep_input_order(self):
+        scheduler = BulkScheduler(max_workers=4, max_pending_per_job=3)
+
+        def work(item):
+            # Later items finish first
+            time.sleep((10 - item) * 0.001)
+            return item * 2
+
+        job = scheduler.create_job("owner", work)
+        self.assertEqual(job.map(range(10)), [item * 2 for item in range(10)])
+        self.assertEqual(job.stats()["rows"], 10)
+
+    def test_empty_job(self):
+        scheduler = BulkScheduler(max_workers=2, max_pending_per_job=2)
+        job = scheduler.create_job("owner", lambda item: item)
+        self.assertEqual(job.map([]), [])
+        self.assertEqual(job.stats()["queue_wait_avg_ms"], 0.0)
+
+    def test_exception_is_raised_from_results(self):
+        scheduler = BulkScheduler(max_workers=2, max_pending_per_job=2)
+
+        def work(item):
+            if item == 3:
+                raise ValueError("bad row")
+            return item
+
+        job = scheduler.create_job("owner", work)
+        with self.assertRaises(ValueError):
+            job.map(range(5))
+
+    def test_interleaves_owners(self):
+        scheduler = BulkScheduler(max_workers=1, max_pending_per_job=100)
+        gate = threading.Event()
+        order = []
+
+        def work(item):
+            gate.wait()
+            order.append(item)
+            return item
+
+        big = scheduler.create_job("big", work)
+        small = scheduler.create_job("small", work)
+        for item in range(20):
+            big.submit(("big", item))
+        for item in range(3):
+            small.submit(("small", item))
+        big.close()
+        small.close()
+        gate.set()
+        big.results()
+        small.results()
+
+        # The single worker may already hold one "big" row when "small" arrives;
+        # after that the two owners alternate until "small" runs out.
+        small_positions = [i for i, (owner, _) in enumerate(order) if owner == "small"]
+        self.assertEqual(len(small_positions), 3)
+        self.assertLessEqual(small_positions[-1], 6)
+
+    def test_producer_blocks_at_max_pending(self):
+        scheduler = BulkScheduler(max_workers=1, max_pending_per_job=2)
+        gate = threading.Event()
+        submitted = []
+
+        job = scheduler.create_job("owner", lambda item: gate.wait() and item)
+
+        def produce():
+            for item in range(10):
+                job.submit(item)
+                submitted.append(item)
+            job.close()
+
+        producer = threading.Thread(target=produce)
+        producer.start()
+        time.sleep(0.1)
+        # One row is running and two are pending; the fourth submit is blocked
+        self.assertEqual(len(submitted), 3)
+        self.assertTrue(producer.is_alive())
+
+        gate.set()
+        producer.join(timeout=5)
+        self.assertEqual(job.results(), list(range(10)))
+        self.assertGreater(job.stats()["producer_blocked_ms"], 0)
+
+
+class BulkIOTests(SimpleTestCase):
+    CSV = "\ufeffsender_name,receiver_name\nAlice,Bob\n".encode("utf-8")
+
+    def read_rows(self, content):
+        upload = SimpleUploadedFile("rows.csv", content)
+        return list(csv.DictReader(open_csv_upload(upload)))
+
+    def test_plain_csv(self):
+        self.assertEqual(self.read_rows(self.CSV), [{"sender_name": "Alice", "receiver_name": "Bob"}])
+
+    def test_gzip_csv_is_detected_by_magic_bytes(self):
+        self.assertEqual(self.read_rows(gzip.compress(self.CSV)), [{"sender_name": "Alice", "receiver_name": "Bob"}])
+
+    def test_truncated_gzip_raises_decode_error(self):
+        with self.assertRaises(UPLOAD_DECODE_ERRORS):
+            self.read_rows(gzip.compress(self.CSV)[:-12])
+
+    def test_bad_tail_is_rejected_before_any_row_is_read(self):
+        content = self.CSV + b"Carol,Dan\n" * 10000 + b"\xff\n"
+        with self.assertRaises(UPLOAD_DECODE_ERRORS):
+            open_csv_upload(SimpleUploadedFile("rows.csv", gzip.compress(content)))
+
+    def test_non_utf8_raises_decode_error(self):
+        with self.assertRaises(UPLOAD_DECODE_ERRORS):
+            self.read_rows(b"sender_name\n\xff\xfe\xfa\n")
+
+    def test_fieldnames_union_keeps_first_seen_order(self):
+        results = [{"a": 1, "error": "x"}, {"a": 2, "b": 3}]
+        self.assertEqual(_fieldnames(results), ["a", "error", "b"])
+
+
+
+class _RecordingCollection:
+    def __init__(self):
+        self.writes = []
+
+    def create_index(self, *args, **kwargs):
+        pass
+
+    def bulk_write(self, operations, ordered=True):
+        self.writes.append(operations)
+
+
+class AnalyticsTests(SimpleTestCase):
+    RECORD = {
+        "lane": "CA-NY", "sp": "03", "created_at": datetime(2024, 12, 1, 23, 57),
+        "ups_cost": 12.5, "usps_cost": 10.0, "ups_days": 5, "usps_days": 7,
+    }
+
+    def test_lane_key(self):
+        self.assertEqual(lane_key({"state": "CA"}, {"state": "NY"}), "CA-NY")
+        self.assertEqual(lane_key({"state": "CA"}, None), "CA-")
+
+    def test_group_keys(self):
+        self.assertEqual(_group_keys(self.RECORD), {"day": "2024-12-01", "lane": "CA-NY", "service": "03"})
+        legacy = {"sender": {"state": "TX"}, "receiver": {"state": "WA"}}
+        self.assertEqual(_group_keys(legacy), {"day": None, "lane": "TX-WA", "service": "unknown"})
+
+    def test_created_at_match_requires_costs(self):
+        match = _created_at_match(datetime(2024, 12, 1), None)["$match"]
+        self.assertEqual(match["created_at"], {"$gte": datetime(2024, 12, 1)})
+        self.assertEqual(match["ups_cost"], {"$type": "number"})
+        self.assertNotIn("created_at", _created_at_match()["$match"])
+
+    def test_rollup_summary_rejects_range_for_all_time_rollups(self):
+        with self.assertRaises(ValueError):
+            rollup_summary({}, "lane", start=datetime(2024, 12, 1))
+
+    def test_update_rollups_skips_missing_costs(self):
+        collection = _RecordingCollection()
+        db = {"shipping_rollups": collection}
+        update_rollups(db, {**self.RECORD, "usps_cost": None})
+        self.assertEqual(collection.writes, [])
+        update_rollups(db, self.RECORD)
+        self.assertEqual(len(collection.writes[0]), 3)
+
+    def test_analytics_parameter_validation(self):
+        factory = APIRequestFactory()
+        for query in (
+            {"group_by": "carrier"},
+            {"source": "cache"},
+            {"start": "12/01/2024"},
+            {"source": "rollup", "group_by": "lane", "start": "2024-12-01"},
+        ):
+            response = shipping_analytics(factory.get("/api/analytics/", query))
+            self.assertEqual(response.status_code, 400, query)
+
+
+@override_settings(MEDIA_URL="/media/", MEDIA_ROOT="/srv/media")
+class LabelsZipTests(SimpleTestCase):
+    def test_label_path_maps_into_labels_dir(self):
+        self.assertEqual(label_path("/media/shipping_labels/label_1.gif"), "/srv/media/shipping_labels/label_1.gif")
+
+    def test_label_path_rejects_traversal_and_other_urls(self):
+        self.assertEqual(label_path("/media/shipping_labels/../../etc/passwd"), "/srv/media/shipping_labels/passwd")
+        self.assertIsNone(label_path("/media/other/label_1.gif"))
+        self.assertIsNone(label_path("/media/shipping_labels/"))
+        self.assertIsNone(label_path(None))
+
+    def test_string_list_from_json(self):
+        self.assertEqual(_string_list({"label_urls": ["a", "b"]}, "label_urls"), ["a", "b"])
+        self.assertIsNone(_string_list({}, "label_urls"))
+        with self.assertRaises(ValueError):
+            _string_list({"label_urls": "/media/shipping_labels/a.gif"}, "label_urls")
+        with self.assertRaises(ValueError):
+            _string_list({"record_ids": [1, 2]}, "record_ids")
+
+    def test_job_id_must_be_a_string(self):
+        request = APIRequestFactory().post("/api/labels_zip/", {"job_id": {"$ne": None}}, format="json")
+        self.assertEqual(labels_zip(request).status_code, 400)
+
+    def test_string_list_from_form_uses_every_value(self):
+        data = QueryDict("label_urls=a&label_urls=b")
+        self.assertEqual(_string_list(data, "label_urls"), ["a", "b"])
+
+
+class AddressTests(SimpleTestCase):
+    ADDRESS = {"name": "Acme Warehouse", "phone": "555-0100", "addr": "1 Main St", "city": "Austin", "state": "TX", "zip": "78701"}
+
+    def test_case_and_whitespace_do_not_change_id(self):
+        messy = {**self.ADDRESS, "name": "  ACME   warehouse ", "addr": "1  main st", "state": "tx"}
+        self.assertEqual(address_id(messy), address_id(self.ADDRESS))
+
+    def test_different_address_has_different_id(self):
+        self.assertNotEqual(address_id({**self.ADDRESS, "zip": "78702"}), address_id(self.ADDRESS))
+
+    def test_cache_holds_the_stored_spelling(self):
+        class Addresses:
+            def find_one_and_update(self, query, update, upsert, return_document):
+                return {"_id": query["_id"], **AddressTests.ADDRESS}
+
+        messy = {**self.ADDRESS, "name": "ACME WAREHOUSE"}
+        key = save_address({"addresses": Addresses()}, messy)
+        self.assertEqual(resolve_addresses({}, [key])[key]["name"], "Acme Warehouse")
+
+    def test_missing_and_extra_fields(self):
+        normalized = normalize_address({"name": "Acme", "state": None, "country": "US"})
+        self.assertEqual(normalized, {"name": "acme", "phone": "", "addr": "", "city": "", "state": "", "zip": ""})
+
+
+class ProfilingTests(SimpleTestCase):
+    @override_settings(PROFILING_TOKEN="secret", PROFILING_SAMPLE_RATE=0)
+    def test_non_ascii_profile_header_is_not_a_match(self):
+        middleware = ProfilingMiddleware(lambda request: HttpResponse("ok"))
+        response = middleware(RequestFactory().get("/api/all_details/", HTTP_X_PROFILE="toké"))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("X-Profile-Id", response)
+
+    def test_timeline_caps_events_but_keeps_totals(self):
+        timeline = Timeline(max_events=2)
+        for duration in (1.0, 2.0, 3.0):
+            timeline.add({"name": "find", "duration_ms": duration})
+        result = timeline.result()
+        self.assertEqual(len(result["events"]), 2)
+        self.assertEqual(result["dropped_events"], 1)
+        self.assertEqual(result["totals"], [{"name": "find", "count": 3, "total_ms": 6.0, "max_ms": 3.0}])
+
+    def test_sampler_includes_bulk_worker_threads(self):
+        profile = RequestProfile("test", max_events=10)
+        sampler = SamplingProfiler(profile, interval=0.001, max_stacks=100)
+        scheduler = BulkScheduler(max_workers=1, max_pending_per_job=10)
+        token = activate_profile(profile)
+        try:
+            job = scheduler.create_job("owner", lambda item: time.sleep(0.05))
+            sampler.start()
+            job.map([1])
+            sampler.stop()
+        finally:
+            deactivate_profile(token)
+
+        stacks = sampler.result()["stacks"]
+        self.assertTrue(all(set(entry) == {"stack", "count"} for entry in stacks))
+        self.assertTrue(any(entry["stack"].startswith("bulk-worker;") for entry in stacks))
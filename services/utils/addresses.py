@@ -0,0 +1,83 @@
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+from collections import OrderedDict
+from django.conf import settings
+import hashlib
+import json
+import threading
+
+ADDRESS_COLLECTION = "addresses"
+ADDRESS_FIELDS = ("name", "phone", "addr", "city", "state", "zip")
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+# Index for the id-based quote lookups in get_shipping_rate and process_row.
+# Built by the migrate_addresses command, never on the request path.
+def ensure_address_indexes(db):
+    db["shipping_costs"].create_index([("sender_id", ASCENDING), ("receiver_id", ASCENDING), ("sp", ASCENDING)])
+
+# Case and whitespace differences do not make a new address
+def normalize_address(address):
+    return {field: " ".join(str(address.get(field) or "").split()).casefold() for field in ADDRESS_FIELDS}
+
+def address_id(address):
+    canonical = json.dumps(normalize_address(address), sort_keys=True)
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+def _cache_get(key):
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    return None
+
+def _cache_put(key, address):
+    with _cache_lock:
+        _cache[key] = address
+        _cache.move_to_end(key)
+        while len(_cache) > getattr(settings, "ADDRESS_CACHE_SIZE", 10000):
+            _cache.popitem(last=False)
+
+def _stored_address(address):
+    return {field: address.get(field) for field in ADDRESS_FIELDS}
+
+# Id of the address document, inserting it the first time the address is seen.
+# The cache holds the stored (first-seen) spelling, not the caller's.
+def save_address(db, address):
+    key = address_id(address)
+    if _cache_get(key) is None:
+        stored = db[ADDRESS_COLLECTION].find_one_and_update(
+            {"_id": key}, {"$setOnInsert": _stored_address(address)},
+            upsert=True, return_document=ReturnDocument.AFTER,
+        )
+        stored.pop("_id")
+        _cache_put(key, stored)
+    return key
+
+# Batch form of save_address for migrations; returns the ids in input order
+def save_addresses(db, addresses):
+    keys = [address_id(address) for address in addresses]
+    operations = {
+        key: UpdateOne({"_id": key}, {"$setOnInsert": _stored_address(address)}, upsert=True)
+        for key, address in zip(keys, addresses)
+    }
+    if operations:
+        db[ADDRESS_COLLECTION].bulk_write(list(operations.values()), ordered=False)
+    return keys
+
+# Map address ids back to address dicts, fetching cache misses in one query
+def resolve_addresses(db, ids):
+    resolved = {}
+    missing = []
+    for key in set(ids):
+        address = _cache_get(key)
+        if address is None:
+            missing.append(key)
+        else:
+            resolved[key] = address
+    if missing:
+        for document in db[ADDRESS_COLLECTION].find({"_id": {"$in": missing}}):
+            key = document.pop("_id")
+            _cache_put(key, document)
+            resolved[key] = document
+    return resolved
@@ -0,0 +1,176 @@
+from pymongo import ASCENDING, UpdateOne
+from django.conf import settings
+import threading
+
+ROLLUP_COLLECTION = "shipping_rollups"
+GROUP_BY_CHOICES = ("day", "lane", "service")
+
+_rollup_index_ready = False
+_rollup_index_lock = threading.Lock()
+
+# Concurrent upserts need this unique index to avoid duplicate rollup documents,
+# so it is created before the first rollup write in each process
+def ensure_rollup_index(db):
+    global _rollup_index_ready
+    with _rollup_index_lock:
+        if _rollup_index_ready:
+            return
+        db[ROLLUP_COLLECTION].create_index([("dimension", ASCENDING), ("key", ASCENDING)], unique=True)
+        _rollup_index_ready = True
+
+# Indexes backing the analytics pipelines. These scan all of shipping_costs, so
+# they are built by the ensure_analytics_indexes command, never on the request path.
+def ensure_analytics_indexes(db):
+    ensure_rollup_index(db)
+    shipping_costs = db["shipping_costs"]
+    shipping_costs.create_index([("created_at", ASCENDING)])
+    shipping_costs.create_index([("lane", ASCENDING), ("created_at", ASCENDING)])
+    shipping_costs.create_index([("sp", ASCENDING), ("created_at", ASCENDING)])
+
+# Lanes run from sender state to receiver state, e.g. "CA-NY"
+def lane_key(sender, receiver):
+    return f"{(sender or {}).get('state') or ''}-{(receiver or {}).get('state') or ''}"
+
+# Aggregation expression producing the group key for a shipping_costs document
+def _group_key_expression(group_by):
+    if group_by == "day":
+        return {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}}
+    if group_by == "lane":
+        # Records not yet migrated to address ids still embed sender/receiver
+        return {"$ifNull": ["$lane", {"$concat": [
+            {"$ifNull": ["$sender.state", ""]}, "-", {"$ifNull": ["$receiver.state", ""]}
+        ]}]}
+    return {"$ifNull": ["$sp", "unknown"]}
+
+# Same keys computed in Python, used when updating rollups for a single record
+def _group_keys(record):
+    created_at = record.get("created_at")
+    return {
+        "day": created_at.strftime("%Y-%m-%d") if created_at else None,
+        "lane": record.get("lane") or lane_key(record.get("sender"), record.get("receiver")),
+        "service": record.get("sp") or "unknown",
+    }
+
+# Quotes missing either cost are left out of both the pipeline and the rollups
+HAS_COSTS = {"ups_cost": {"$type": "number"}, "usps_cost": {"$type": "number"}}
+
+def _has_costs(record):
+    return all(
+        isinstance(record.get(field), (int, float)) and not isinstance(record.get(field), bool)
+        for field in ("ups_cost", "usps_cost")
+    )
+
+def _totals_group(key):
+    return {"$group": {
+        "_id": key,
+        "shipments": {"$sum": 1},
+        "ups_cost_total": {"$sum": "$ups_cost"},
+        "usps_cost_total": {"$sum": "$usps_cost"},
+        "optimal_cost_total": {"$sum": {"$min": ["$ups_cost", "$usps_cost"]}},
+        "ups_wins": {"$sum": {"$cond": [{"$lte": ["$ups_cost", "$usps_cost"]}, 1, 0]}},
+        "ups_days_total": {"$sum": "$ups_days"},
+        "usps_days_total": {"$sum": "$usps_days"},
+    }}
+
+# Turns raw totals (from the pipeline or a rollup document) into dashboard figures
+def _summary_projection():
+    return {"$project": {
+        "_id": 0,
+        "key": 1,
+        "shipments": 1,
+        "ups_cost_total": {"$round": ["$ups_cost_total", 2]},
+        "usps_cost_total": {"$round": ["$usps_cost_total", 2]},
+        "optimal_cost_total": {"$round": ["$optimal_cost_total", 2]},
+        "savings_vs_ups": {"$round": [{"$subtract": ["$ups_cost_total", "$optimal_cost_total"]}, 2]},
+        "savings_vs_usps": {"$round": [{"$subtract": ["$usps_cost_total", "$optimal_cost_total"]}, 2]},
+        "ups_wins": 1,
+        "usps_wins": {"$subtract": ["$shipments", "$ups_wins"]},
+        "avg_ups_days": {"$round": [{"$divide": ["$ups_days_total", "$shipments"]}, 2]},
+        "avg_usps_days": {"$round": [{"$divide": ["$usps_days_total", "$shipments"]}, 2]},
+    }}
+
+def _created_at_match(start=None, end=None):
+    match = dict(HAS_COSTS)
+    if start or end:
+        match["created_at"] = {}
+        if start:
+            match["created_at"]["$gte"] = start
+        if end:
+            match["created_at"]["$lt"] = end
+    return {"$match": match}
+
+def shipping_summary(db, group_by, start=None, end=None):
+    pipeline = [
+        _created_at_match(start, end),
+        _totals_group(_group_key_expression(group_by)),
+        {"$addFields": {"key": "$_id"}},
+        _summary_projection(),
+        {"$sort": {"key": 1}},
+    ]
+    return list(db["shipping_costs"].aggregate(pipeline))
+
+# Reads the precomputed rollups; day keys are ISO dates so they filter as strings.
+# Lane and service rollups are all-time totals and cannot be filtered by date.
+def rollup_summary(db, group_by, start=None, end=None):
+    if group_by != "day" and (start or end):
+        raise ValueError("Rollups by lane and service are all-time totals.")
+    match = {"dimension": group_by}
+    if start or end:
+        match["key"] = {}
+        if start:
+            match["key"]["$gte"] = start.strftime("%Y-%m-%d")
+        if end:
+            match["key"]["$lt"] = end.strftime("%Y-%m-%d")
+    pipeline = [{"$match": match}, _summary_projection(), {"$sort": {"key": 1}}]
+    return list(db[ROLLUP_COLLECTION].aggregate(pipeline))
+
+# Fold one newly saved shipping_costs record into the rollup documents
+def update_rollups(db, record):
+    if not getattr(settings, "ANALYTICS_ROLLUPS_ENABLED", True) or not _has_costs(record):
+        return
+    ups_cost = record["ups_cost"]
+    usps_cost = record["usps_cost"]
+    increments = {
+        "shipments": 1,
+        "ups_cost_total": ups_cost,
+        "usps_cost_total": usps_cost,
+        "optimal_cost_total": min(ups_cost, usps_cost),
+        "ups_wins": 1 if ups_cost <= usps_cost else 0,
+        "ups_days_total": record.get("ups_days") or 0,
+        "usps_days_total": record.get("usps_days") or 0,
+    }
+    ensure_rollup_index(db)
+    operations = [
+        UpdateOne({"dimension": dimension, "key": key}, {"$inc": increments}, upsert=True)
+        for dimension, key in _group_keys(record).items()
+        if key is not None
+    ]
+    db[ROLLUP_COLLECTION].bulk_write(operations, ordered=False)
+
+# Recompute every rollup document server-side from shipping_costs. The new rollups
+# are built in a scratch collection and swapped in with a rename, so readers never
+# see a partial set; increments from quotes saved while the rebuild runs may be
+# lost, and a later rebuild picks them up.
+def rebuild_rollups(db):
+    scratch = db[f"{ROLLUP_COLLECTION}_rebuild"]
+    scratch.drop()
+    scratch.create_index([("dimension", ASCENDING), ("key", ASCENDING)], unique=True)
+    for dimension in GROUP_BY_CHOICES:
+        db["shipping_costs"].aggregate([
+            {"$match": HAS_COSTS},
+            _totals_group(_group_key_expression(dimension)),
+            {"$project": {
+                "_id": 0,
+                "dimension": {"$literal": dimension},
+                "key": "$_id",
+                "shipments": 1,
+                "ups_cost_total": 1,
+                "usps_cost_total": 1,
+                "optimal_cost_total": 1,
+                "ups_wins": 1,
+                "ups_days_total": 1,
+                "usps_days_total": 1,
+            }},
+            {"$merge": {"into": scratch.name, "on": ["dimension", "key"], "whenMatched": "replace", "whenNotMatched": "insert"}},
+        ])
+    scratch.rename(ROLLUP_COLLECTION, dropTarget=True)
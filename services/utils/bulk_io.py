@@ -0,0 +1,75 @@
+from pymongo import ASCENDING
+from django.http import HttpResponse
+import csv
+import gzip
+import io
+import json
+import threading
+import zlib
+
+GZIP_MAGIC = b"\x1f\x8b"
+CHUNK_SIZE = 64 * 1024
+# Raised while reading rows from a corrupt gzip or non-UTF-8 upload
+UPLOAD_DECODE_ERRORS = (gzip.BadGzipFile, EOFError, zlib.error, UnicodeDecodeError)
+OUTPUT_FORMATS = {
+    "csv": ("text/csv", "bulk_shipping_results.csv"),
+    "jsonl": ("application/x-ndjson", "bulk_shipping_results.jsonl"),
+}
+
+_indexes_ready = False
+_indexes_lock = threading.Lock()
+
+# Indexes for the bulk_summary/ and labels_zip/ lookups by job id
+def ensure_bulk_job_indexes(db):
+    global _indexes_ready
+    with _indexes_lock:
+        if _indexes_ready:
+            return
+        db["bulk_jobs"].create_index([("job_id", ASCENDING)], unique=True)
+        db["bulk_job_labels"].create_index([("job_id", ASCENDING), ("row", ASCENDING)])
+        _indexes_ready = True
+
+def _text_stream(uploaded_file):
+    head = uploaded_file.read(len(GZIP_MAGIC))
+    uploaded_file.seek(0)
+    stream = uploaded_file
+    if head == GZIP_MAGIC:
+        stream = gzip.GzipFile(fileobj=uploaded_file, mode="rb")
+    return io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+
+# Text stream over an uploaded CSV, decompressing gzip uploads as rows are read.
+# The whole upload is decoded once up front (Django has already buffered it), so
+# a corrupt gzip tail or bad UTF-8 raises UPLOAD_DECODE_ERRORS here, before any
+# row is handed to the bulk scheduler.
+def open_csv_upload(uploaded_file):
+    text = _text_stream(uploaded_file)
+    while text.read(CHUNK_SIZE):
+        pass
+    # Detach so closing the wrapper leaves the upload open for the real read
+    stream = text.detach()
+    if stream is not uploaded_file:
+        stream.close()
+    uploaded_file.seek(0)
+    return _text_stream(uploaded_file)
+
+# Column order of the first result, followed by any extra keys seen later (e.g. "error")
+def _fieldnames(results):
+    fieldnames = {}
+    for result in results:
+        for key in result:
+            fieldnames.setdefault(key, None)
+    return list(fieldnames)
+
+def results_response(results, output="csv"):
+    content_type, filename = OUTPUT_FORMATS[output]
+    response = HttpResponse(content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+
+    if output == "jsonl":
+        for result in results:
+            response.write(json.dumps(result, default=str) + "\n")
+    else:
+        writer = csv.DictWriter(response, fieldnames=_fieldnames(results))
+        writer.writeheader()
+        writer.writerows(results)
+    return response
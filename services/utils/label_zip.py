@@ -0,0 +1,74 @@
+from django.conf import settings
+import csv
+import io
+import os
+import zipfile
+
+LABELS_DIR = "shipping_labels"
+CHUNK_SIZE = 64 * 1024
+
+# Write-only sink for ZipFile; whatever has been written is handed back by pop()
+class _ZipStream(io.RawIOBase):
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def pop(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+# Map a label_url from shipping_costs back to the saved file, ignoring anything outside the labels dir
+def label_path(label_url):
+    prefix = f"{settings.MEDIA_URL}{LABELS_DIR}/"
+    if not label_url or not label_url.startswith(prefix):
+        return None
+    filename = os.path.basename(label_url[len(prefix):])
+    if not filename:
+        return None
+    return os.path.join(settings.MEDIA_ROOT, LABELS_DIR, filename)
+
+# Yield a ZIP archive of the given labels chunk by chunk, ending with manifest.csv.
+# Entries are dicts with "row", "record_id" and "label_url"; files are stored as-is
+# since the GIF labels are already compressed.
+def stream_labels_zip(entries):
+    stream = _ZipStream()
+    manifest = io.StringIO()
+    writer = csv.DictWriter(manifest, fieldnames=["row", "record_id", "label_url", "file", "status"])
+    writer.writeheader()
+    written = set()
+
+    with zipfile.ZipFile(stream, mode="w", compression=zipfile.ZIP_STORED) as archive:
+        for entry in entries:
+            path = label_path(entry.get("label_url"))
+            arcname = f"labels/{os.path.basename(path)}" if path else ""
+            status = "ok"
+            if not path or not os.path.isfile(path):
+                arcname, status = "", "missing"
+            elif arcname not in written:
+                with open(path, "rb") as src, archive.open(arcname, "w") as dst:
+                    while True:
+                        chunk = src.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        dst.write(chunk)
+                        yield stream.pop()
+                written.add(arcname)
+                yield stream.pop()
+
+            writer.writerow({
+                "row": entry.get("row", ""),
+                "record_id": entry.get("record_id", ""),
+                "label_url": entry.get("label_url") or "",
+                "file": arcname,
+                "status": status,
+            })
+
+        archive.writestr("manifest.csv", manifest.getvalue())
+    yield stream.pop()
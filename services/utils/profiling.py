@@ -0,0 +1,188 @@
+from pymongo import monitoring
+from contextlib import contextmanager
+from collections import Counter
+from contextvars import ContextVar
+from django.conf import settings
+from datetime import datetime
+import json
+import os
+import sys
+import threading
+import time
+
+_current_profile = ContextVar("current_profile", default=None)
+
+# Keeps the first max_events events and per-name totals for all of them, so
+# a profiled 100k-row bulk run stays a bounded document
+class Timeline:
+    def __init__(self, max_events):
+        self.max_events = max_events
+        self.events = []
+        self.dropped = 0
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    def add(self, event):
+        with self._lock:
+            totals = self._totals.setdefault(event["name"], {"name": event["name"], "count": 0, "total_ms": 0.0, "max_ms": 0.0})
+            totals["count"] += 1
+            totals["total_ms"] = round(totals["total_ms"] + event["duration_ms"], 3)
+            totals["max_ms"] = max(totals["max_ms"], event["duration_ms"])
+            if len(self.events) < self.max_events:
+                self.events.append(event)
+            else:
+                self.dropped += 1
+
+    def result(self):
+        with self._lock:
+            return {
+                "totals": sorted(self._totals.values(), key=lambda totals: -totals["total_ms"]),
+                "events": list(self.events),
+                "dropped_events": self.dropped,
+            }
+
+# Timeline of Mongo commands and carrier calls made while serving one profiled
+# request, plus the threads currently doing work for it
+class RequestProfile:
+    def __init__(self, profile_id, max_events):
+        self.profile_id = profile_id
+        self.started_at = time.perf_counter()
+        self.mongo = Timeline(max_events)
+        self.carrier = Timeline(max_events)
+        self._threads = {threading.get_ident(): "request"}
+        self._threads_lock = threading.Lock()
+
+    def _offset_ms(self, timestamp):
+        return round((timestamp - self.started_at) * 1000, 3)
+
+    def add_event(self, timeline, name, started_at, duration, **extra):
+        timeline.add({
+            "name": name,
+            "start_ms": self._offset_ms(started_at),
+            "duration_ms": round(duration * 1000, 3),
+            "thread": threading.current_thread().name,
+            **extra,
+        })
+
+    def add_thread(self, thread_id, label):
+        with self._threads_lock:
+            self._threads[thread_id] = label
+
+    def remove_thread(self, thread_id):
+        with self._threads_lock:
+            self._threads.pop(thread_id, None)
+
+    def threads(self):
+        with self._threads_lock:
+            return dict(self._threads)
+
+def current_profile():
+    return _current_profile.get()
+
+def activate_profile(profile):
+    return _current_profile.set(profile)
+
+def deactivate_profile(token):
+    _current_profile.reset(token)
+
+# Include the current thread in the active profile's CPU samples while it works for it
+@contextmanager
+def profiled_thread(label):
+    profile = current_profile()
+    if profile is None:
+        yield
+        return
+    thread_id = threading.get_ident()
+    profile.add_thread(thread_id, label)
+    try:
+        yield
+    finally:
+        profile.remove_thread(thread_id)
+
+# Time a carrier API call into the active profile, if any
+@contextmanager
+def carrier_span(name):
+    profile = current_profile()
+    started_at = time.perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        if profile is not None:
+            profile.add_event(profile.carrier, name, started_at, time.perf_counter() - started_at, ok=ok)
+
+# Registered on the shared MongoClient; callbacks run on the thread issuing the command
+class MongoCommandTimeline(monitoring.CommandListener):
+    def _record(self, event, ok):
+        profile = current_profile()
+        if profile is None:
+            return
+        duration = event.duration_micros / 1_000_000
+        profile.add_event(profile.mongo, event.command_name, time.perf_counter() - duration, duration,
+                          database=event.database_name, ok=ok)
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event, True)
+
+    def failed(self, event):
+        self._record(event, False)
+
+# Samples the Python stacks of the profile's threads (the request thread and any
+# bulk workers running its rows) from a background thread at a fixed interval,
+# counting collapsed "thread;file:function:line;..." stacks as flame graph tools expect.
+class SamplingProfiler:
+    def __init__(self, profile, interval, max_stacks):
+        self.profile = profile
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id, label in self.profile.threads().items():
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                if stack:
+                    stack.append(label)
+                    self.stacks[";".join(reversed(stack))] += 1
+                    self.samples += 1
+
+    # Stacks are returned as a list, since their text is not usable as Mongo field names
+    def result(self):
+        most_common = self.stacks.most_common()
+        return {
+            "interval_ms": self.interval * 1000,
+            "samples": self.samples,
+            "stacks": [{"stack": stack, "count": count} for stack, count in most_common[:self.max_stacks]],
+            "dropped_stacks": max(0, len(most_common) - self.max_stacks),
+        }
+
+# Persist a finished profile to PROFILING_DIR or the request_profiles collection
+def save_profile(document):
+    if getattr(settings, "PROFILING_STORAGE", "directory") == "mongo":
+        from .mongo import get_mongo_db
+        get_mongo_db()["request_profiles"].insert_one({**document, "created_at": datetime.now()})
+        return
+    profiles_dir = getattr(settings, "PROFILING_DIR", os.path.join(settings.BASE_DIR, "profiles"))
+    os.makedirs(profiles_dir, exist_ok=True)
+    with open(os.path.join(profiles_dir, f"{document['profile_id']}.json"), "w") as f:
+        json.dump(document, f, default=str)
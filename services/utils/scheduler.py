@@ -0,0 +1,166 @@
+import contextvars
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from django.conf import settings
+from .profiling import profiled_thread
+
+
+# A single bulk upload registered with the shared scheduler
+class BulkJob:
+    def __init__(self, scheduler, owner, fn):
+        self.id = str(uuid.uuid4())
+        self.owner = owner
+        self._scheduler = scheduler
+        self._fn = fn
+        # Rows run in the submitting request's context, e.g. its active profile
+        self._context = contextvars.copy_context()
+        self._pending = deque()
+        self._queued = False
+        self._results = {}
+        self._submitted = 0
+        self._completed = 0
+        self._closed = False
+        self._finished = threading.Event()
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._blocked_total = 0.0
+
+    # Queue one item, blocking while this job already has a full backlog
+    def submit(self, item):
+        self._scheduler._enqueue(self, item)
+
+    # Mark the job as fully submitted; results() returns once every item ran
+    def close(self):
+        self._scheduler._close(self)
+
+    def results(self):
+        self._finished.wait()
+        results = [self._results[i] for i in range(self._submitted)]
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return results
+
+    # Submit every item, then wait for all of them, preserving input order
+    def map(self, items):
+        try:
+            for item in items:
+                self.submit(item)
+        finally:
+            self.close()
+        return self.results()
+
+    def stats(self):
+        return {
+            "job_id": self.id,
+            "rows": self._submitted,
+            "queue_wait_avg_ms": round(self._wait_total / self._completed * 1000, 2) if self._completed else 0.0,
+            "queue_wait_max_ms": round(self._wait_max * 1000, 2),
+            "producer_blocked_ms": round(self._blocked_total * 1000, 2),
+        }
+
+
+# Process-wide worker pool shared by every bulk upload. Workers pick the next
+# row round-robin across owners (and across an owner's jobs), so one huge file
+# cannot starve smaller uploads, and each job keeps at most max_pending rows in
+# memory before its producer is made to wait.
+class BulkScheduler:
+    def __init__(self, max_workers, max_pending_per_job):
+        self.max_workers = max_workers
+        self.max_pending_per_job = max_pending_per_job
+        self._cond = threading.Condition()
+        self._owners = OrderedDict()
+        self._workers = []
+
+    def create_job(self, owner, fn):
+        self._start_workers()
+        return BulkJob(self, owner, fn)
+
+    def _start_workers(self):
+        with self._cond:
+            while len(self._workers) < self.max_workers:
+                worker = threading.Thread(target=self._work, name=f"bulk-worker-{len(self._workers)}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    # A row's queue wait starts when it is submitted, so time spent blocked on
+    # backpressure counts towards it as well as towards producer_blocked_ms
+    def _enqueue(self, job, item):
+        submitted_at = time.monotonic()
+        with self._cond:
+            if job._closed:
+                raise RuntimeError("Cannot submit to a closed bulk job.")
+            while len(job._pending) >= self.max_pending_per_job:
+                self._cond.wait()
+            job._blocked_total += time.monotonic() - submitted_at
+            job._pending.append((job._submitted, item, submitted_at))
+            job._submitted += 1
+            if not job._queued:
+                job._queued = True
+                self._owners.setdefault(job.owner, deque()).append(job)
+            self._cond.notify_all()
+
+    def _close(self, job):
+        with self._cond:
+            job._closed = True
+            if job._completed == job._submitted:
+                job._finished.set()
+
+    # Must be called with the lock held
+    def _next_task(self):
+        while not self._owners:
+            self._cond.wait()
+        owner, jobs = self._owners.popitem(last=False)
+        job = jobs.popleft()
+        index, item, enqueued_at = job._pending.popleft()
+        if job._pending:
+            jobs.append(job)
+        else:
+            job._queued = False
+        if jobs:
+            # Re-inserting moves the owner to the back of the rotation
+            self._owners[owner] = jobs
+        return job, index, item, enqueued_at
+
+    def _work(self):
+        while True:
+            with self._cond:
+                job, index, item, enqueued_at = self._next_task()
+                # A slot in the job's backlog was freed for its producer
+                self._cond.notify_all()
+
+            started_at = time.monotonic()
+            try:
+                result = job._context.copy().run(self._run_task, job, item)
+            except Exception as e:
+                result = e
+
+            with self._cond:
+                waited = started_at - enqueued_at
+                job._wait_total += waited
+                job._wait_max = max(job._wait_max, waited)
+                job._results[index] = result
+                job._completed += 1
+                if job._closed and job._completed == job._submitted:
+                    job._finished.set()
+
+    # Runs inside the job's context, so a profiled request also samples this worker
+    def _run_task(self, job, item):
+        with profiled_thread("bulk-worker"):
+            return job._fn(item)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_bulk_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = BulkScheduler(
+                max_workers=getattr(settings, "BULK_MAX_WORKERS", 64),
+                max_pending_per_job=getattr(settings, "BULK_MAX_PENDING_PER_JOB", 500),
+            )
+        return _scheduler
@@ -3,15 +3,24 @@ from rest_framework.parsers import FileUploadParser, MultiPartParser
 from rest_framework.response import Response
 from rest_framework import status
 from .utils.mongo import get_mongo_db
+from .utils.scheduler import get_bulk_scheduler
+from .utils.bulk_io import OUTPUT_FORMATS, UPLOAD_DECODE_ERRORS, ensure_bulk_job_indexes, open_csv_upload, results_response
+from .utils.label_zip import stream_labels_zip
+from .utils.addresses import resolve_addresses, save_address
+from .utils.profiling import carrier_span
+from .utils.analytics import GROUP_BY_CHOICES, lane_key, rollup_summary, shipping_summary, update_rollups
 import bcrypt
-from django.http import HttpResponse
+from django.http import QueryDict, StreamingHttpResponse
+from django.views.decorators.gzip import gzip_page
+from bson import ObjectId
+from bson.errors import InvalidId
 import base64
 import requests
 from django.conf import settings
 import random
 import csv
-from io import StringIO
-import concurrent
+import json
+import hashlib
 from datetime import datetime
 import uuid
 import os
@@ -67,7 +76,8 @@ def login(request):
             "Authorization": f"Basic {base64.b64encode(credentials.encode()).decode()}"
         }
         payload = {"grant_type": "client_credentials"}
-        response = requests.post("https://onlinetools.ups.com/security/v1/oauth/token", headers=headers, data=payload)
+        with carrier_span("ups.oauth_token"):
+            response = requests.post("https://onlinetools.ups.com/security/v1/oauth/token", headers=headers, data=payload)
         if response.status_code == 200:
             access_token = response.json().get('access_token')
         return Response({"Message": "Login successful", "User ID": str(user['_id']), "token": access_token}, status=status.HTTP_200_OK)
@@ -113,7 +123,8 @@ def validate_address(request):
 
     # Make the POST request to the UPS API
     try:
-        response = requests.post("https://onlinetools.ups.com/api/addressvalidation/v2/1", headers=headers, json=payload)
+        with carrier_span("ups.address_validation"):
+            response = requests.post("https://onlinetools.ups.com/api/addressvalidation/v2/1", headers=headers, json=payload)
         response.raise_for_status()  # Raise an HTTPError if the response code indicates failure
     except requests.exceptions.HTTPError as http_err:
         return Response({"error": "Address validation failed.", "details": str(http_err)}, status=response.status_code)
@@ -213,7 +224,8 @@ def ups_shipping(access_token, address_data):
 
     try:
         # Send request to UPS Shipment API
-        response = requests.post(url, json=payload, headers=headers)
+        with carrier_span("ups.ship"):
+            response = requests.post(url, json=payload, headers=headers)
         response.raise_for_status()  # Raises an HTTPError if the response code is not 200
 
         if response.status_code == 200:
@@ -262,11 +274,13 @@ def get_shipping_rate(request):
     # Connect to the database
     db = get_mongo_db()
     collection = db["shipping_costs"]
+    sender_id = save_address(db, sender)
+    receiver_id = save_address(db, receiver)
 
     # Check if the record exists in the database
     existing_record = collection.find_one({
-        "sender": sender,
-        "receiver": receiver,
+        "sender_id": sender_id,
+        "receiver_id": receiver_id,
         "sp" : serviceType
     })
 
@@ -320,8 +334,10 @@ def get_shipping_rate(request):
 
     # Save the sender, receiver, and calculated costs to the database
     record = {
-        "sender": sender,
-        "receiver": receiver,
+        "sender_id": sender_id,
+        "receiver_id": receiver_id,
+        "lane": lane_key(sender, receiver),
+        "sp": serviceType,
         "ups_cost": usp_cost,
         "usps_cost": usps_cost.get("shipping_cost"),
         "ups_days": ups_response.get("days"),
@@ -330,6 +346,11 @@ def get_shipping_rate(request):
         "created_at": datetime.now()
     }
     collection.insert_one(record)
+    try:
+        update_rollups(db, record)
+    except Exception as e:
+        # The quote is saved; rebuild_shipping_rollups can repair the totals
+        print(f"Error while updating shipping rollups: {e}")
 
     return Response({
         "ups": usp_cost,
@@ -358,15 +379,19 @@ def process_row(row, access_token):
         "state": row.get("receiver_state", "").strip(),
         "zip": row.get("receiver_zip", "").strip(),
     }
+    # Optional column; rows without it count as service "unknown" in analytics
+    service_type = (row.get("serviceType") or "").strip() or None
 
     # Connect to the database
     db = get_mongo_db()
     collection = db["shipping_costs"]
+    sender_id = save_address(db, sender)
+    receiver_id = save_address(db, receiver)
 
     # Check if the record exists in the database
     existing_record = collection.find_one({
-        "sender": sender,
-        "receiver": receiver
+        "sender_id": sender_id,
+        "receiver_id": receiver_id
     })
 
     if existing_record:
@@ -381,7 +406,7 @@ def process_row(row, access_token):
                 "optimal_cost": min(existing_record.get("ups_cost"), existing_record.get("usps_cost"))}
 
     # Fetch UPS shipping rates
-    ups_response = ups_shipping(access_token, {"sender": sender, "receiver": receiver})
+    ups_response = ups_shipping(access_token, {"sender": sender, "receiver": receiver, "serviceType": service_type})
 
     if "error" in ups_response:
         return {**row, "error": ups_response["error"]}
@@ -419,8 +444,10 @@ def process_row(row, access_token):
 
     # Save the sender, receiver, and calculated costs to the database
     record = {
-        "sender": sender,
-        "receiver": receiver,
+        "sender_id": sender_id,
+        "receiver_id": receiver_id,
+        "lane": lane_key(sender, receiver),
+        "sp": service_type,
         "ups_cost": ups_cost,
         "ups_days": ups_response.get("days"),
         "usps_days": usps_cost.get("days"),
@@ -429,6 +456,11 @@ def process_row(row, access_token):
         "created_at": datetime.now()
     }
     collection.insert_one(record)
+    try:
+        update_rollups(db, record)
+    except Exception as e:
+        # The quote is saved; rebuild_shipping_rollups can repair the totals
+        print(f"Error while updating shipping rollups: {e}")
 
     # Determine the optimal service and cost
     optimal_service = "UPS" if ups_cost <= usps_cost.get("shipping_cost") else "USPS"
@@ -443,7 +475,15 @@ def process_row(row, access_token):
             "optimal_service": optimal_service, 
             "optimal_cost": optimal_cost}
 
-# Bulk CSV shipping rate calculation view
+# Keep one failing row from failing the whole bulk job
+def process_row_safely(row, access_token):
+    try:
+        return process_row(row, access_token)
+    except Exception as e:
+        return {**row, "error": str(e)}
+
+# Bulk CSV shipping rate calculation view; responses are gzipped for clients sending Accept-Encoding: gzip
+@gzip_page
 @api_view(['POST'])
 @parser_classes([MultiPartParser, FileUploadParser])
 def bulk_shipping_rate_calculation(request):
@@ -456,10 +496,13 @@ def bulk_shipping_rate_calculation(request):
     if not access_token:
         return Response({"error": "Access token is missing. Please log in again."}, status=status.HTTP_401_UNAUTHORIZED)
 
+    output = request.data.get("output", "csv")
+    if output not in OUTPUT_FORMATS:
+        return Response({"error": "Invalid output format.", "choices": list(OUTPUT_FORMATS)}, status=status.HTTP_400_BAD_REQUEST)
+
     try:
-        # Read the CSV file
-        file_data = csv_file.read().decode('utf-8-sig')
-        csv_reader = csv.DictReader(StringIO(file_data))
+        # Read the CSV file, decompressing gzip uploads as rows are consumed
+        csv_reader = csv.DictReader(open_csv_upload(csv_file))
 
         # Validate required columns
         required_columns = [
@@ -474,55 +517,172 @@ def bulk_shipping_rate_calculation(request):
                 "required_columns": required_columns
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        # Process rows in parallel for faster processing
-        with concurrent.futures.ThreadPoolExecutor(max_workers=300) as executor:
-            results = list(executor.map(lambda row: process_row(row, access_token), csv_reader))
-
-        # Filter out successful results and errors
-        successful_results = [r for r in results if "error" not in r]
-        error_results = [r for r in results if "error" in r]
-
-        # Create a response CSV with results
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="bulk_shipping_results.csv"'
-
-        # Get the fieldnames from the first successful result, if any
-        if successful_results:
-            fieldnames = list(successful_results[0].keys())
-        elif error_results:
-            fieldnames = list(error_results[0].keys())
-        else:
+        # Process rows on the shared bulk scheduler, sharing workers fairly with other uploads
+        # Never store the UPS token itself; anonymous uploads are keyed by its hash
+        owner = request.data.get("user_id") or f"token:{hashlib.sha256(access_token.encode('utf-8')).hexdigest()[:16]}"
+        job = get_bulk_scheduler().create_job(owner, lambda row: process_row_safely(row, access_token))
+        results = job.map(csv_reader)
+        job_stats = job.stats()
+        print(f"Bulk job {job_stats['job_id']}: {job_stats['rows']} rows, "
+              f"queue wait avg {job_stats['queue_wait_avg_ms']}ms, max {job_stats['queue_wait_max_ms']}ms, "
+              f"producer blocked {job_stats['producer_blocked_ms']}ms")
+
+        if not results:
             return Response({"error": "No results generated"}, status=status.HTTP_400_BAD_REQUEST)
 
-        writer = csv.DictWriter(response, fieldnames=fieldnames)
-        writer.writeheader()
-        
-        # Write all results (both successful and errors)
-        writer.writerows(results)
-
-        # Add summary at the end of the CSV
-        writer.writerow({})  # Empty row for spacing
-        writer.writerow({
-            "sender_name": "Summary",
-            "ups_cost": f"Total Successful: {len(successful_results)}",
-            "usps_cost": f"Total Errors: {len(error_results)}"
-        })
-
+        # Machine-readable summary, stored for bulk_summary/ and echoed in a header
+        error_count = sum(1 for r in results if "error" in r)
+        summary = {
+            **job_stats,
+            "successful": len(results) - error_count,
+            "errors": error_count,
+            "output": output,
+        }
+        db = get_mongo_db()
+        ensure_bulk_job_indexes(db)
+        db["bulk_jobs"].insert_one({**summary, "owner": owner, "created_at": datetime.now()})
+
+        # Remember which row produced which label, for labels_zip/
+        labels = [
+            {"job_id": job_stats["job_id"], "row": index, "label_url": r["label_url"]}
+            for index, r in enumerate(results, start=1) if r.get("label_url")
+        ]
+        if labels:
+            db["bulk_job_labels"].insert_many(labels)
+
+        response = results_response(results, output)
+        response['X-Bulk-Job-Id'] = job_stats["job_id"]
+        response['X-Bulk-Queue-Wait-Avg-Ms'] = str(job_stats["queue_wait_avg_ms"])
+        response['X-Bulk-Queue-Wait-Max-Ms'] = str(job_stats["queue_wait_max_ms"])
+        response['X-Bulk-Producer-Blocked-Ms'] = str(job_stats["producer_blocked_ms"])
+        response['X-Bulk-Summary'] = json.dumps(summary)
         return response
 
+    except UPLOAD_DECODE_ERRORS as e:
+        return Response({
+            "error": "CSV file could not be read. Upload UTF-8 CSV, optionally gzip-compressed.",
+            "details": str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         return Response({
             "error": "An error occurred while processing the CSV file",
             "details": str(e)
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+@api_view(['GET'])
+def bulk_summary(request, job_id):
+    db = get_mongo_db()
+    ensure_bulk_job_indexes(db)
+    summary = db["bulk_jobs"].find_one({"job_id": job_id}, {"_id": 0, "owner": 0})
+    if not summary:
+        return Response({"error": "Bulk job not found."}, status=status.HTTP_404_NOT_FOUND)
+    return Response(summary, status=status.HTTP_200_OK)
+
+# List of strings from JSON, or every value of a repeated form field
+def _string_list(data, name):
+    if isinstance(data, QueryDict):
+        values = data.getlist(name)
+    else:
+        values = data.get(name)
+    if values is None:
+        return None
+    if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+        raise ValueError(f"{name} must be a list of strings.")
+    return values
+
+# Stream one ZIP of label files for a bulk job, a list of label URLs or shipping_costs record ids
+@api_view(['POST'])
+def labels_zip(request):
+    job_id = request.data.get("job_id")
+    if job_id is not None and not isinstance(job_id, str):
+        return Response({"error": "job_id must be a string."}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        label_urls = _string_list(request.data, "label_urls")
+        record_ids = _string_list(request.data, "record_ids")
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    max_entries = getattr(settings, "LABELS_ZIP_MAX_ENTRIES", 5000)
+    if len(label_urls or record_ids or []) > max_entries:
+        return Response({"error": f"At most {max_entries} labels can be requested at once."}, status=status.HTTP_400_BAD_REQUEST)
+    db = get_mongo_db()
+    ensure_bulk_job_indexes(db)
+
+    if job_id:
+        if not db["bulk_jobs"].find_one({"job_id": job_id}, {"_id": 1}):
+            return Response({"error": "Bulk job not found."}, status=status.HTTP_404_NOT_FOUND)
+        entries = db["bulk_job_labels"].find({"job_id": job_id}, {"_id": 0, "row": 1, "label_url": 1}).sort("row", 1)
+        filename = f"labels_{job_id}.zip"
+    elif label_urls:
+        entries = [{"row": index, "label_url": url} for index, url in enumerate(label_urls, start=1)]
+        filename = "labels.zip"
+    elif record_ids:
+        try:
+            object_ids = [ObjectId(record_id) for record_id in record_ids]
+        except InvalidId:
+            return Response({"error": "Invalid record id."}, status=status.HTTP_400_BAD_REQUEST)
+        found = {
+            str(record["_id"]): record.get("label_url")
+            for record in db["shipping_costs"].find({"_id": {"$in": object_ids}}, {"label_url": 1})
+        }
+        entries = [
+            {"row": index, "record_id": str(object_id), "label_url": found.get(str(object_id))}
+            for index, object_id in enumerate(object_ids, start=1)
+        ]
+        filename = "labels.zip"
+    else:
+        return Response({"error": "Provide a job_id, label_urls or record_ids."}, status=status.HTTP_400_BAD_REQUEST)
+
+    response = StreamingHttpResponse(stream_labels_zip(entries), content_type="application/zip")
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
 @api_view(['GET'])
 def all_details(request):
     db = get_mongo_db()
     collection = db["shipping_costs"]
     
     data = list(collection.find({}))
-    
+
+    # Expand address ids back into sender/receiver documents
+    addresses = resolve_addresses(db, [item[key] for item in data for key in ("sender_id", "receiver_id") if key in item])
     for item in data:
         item.pop('_id', None)  
+        if "sender_id" in item:
+            item["sender"] = addresses.get(item.pop("sender_id"))
+        if "receiver_id" in item:
+            item["receiver"] = addresses.get(item.pop("receiver_id"))
     return Response(data)
+
+@api_view(['GET'])
+def shipping_analytics(request):
+    group_by = request.query_params.get("group_by", "day")
+    source = request.query_params.get("source", "pipeline")
+    if group_by not in GROUP_BY_CHOICES:
+        return Response({"error": "Invalid group_by.", "choices": list(GROUP_BY_CHOICES)}, status=status.HTTP_400_BAD_REQUEST)
+    if source not in ("pipeline", "rollup"):
+        return Response({"error": "Invalid source.", "choices": ["pipeline", "rollup"]}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Optional date range, start inclusive and end exclusive (YYYY-MM-DD)
+    try:
+        start = request.query_params.get("start")
+        end = request.query_params.get("end")
+        start = datetime.strptime(start, "%Y-%m-%d") if start else None
+        end = datetime.strptime(end, "%Y-%m-%d") if end else None
+    except ValueError:
+        return Response({"error": "start and end must be dates in YYYY-MM-DD format."}, status=status.HTTP_400_BAD_REQUEST)
+
+    if source == "rollup" and group_by != "day" and (start or end):
+        return Response({
+            "error": "Rollups by lane and service are all-time totals. Use source=pipeline for a date range."
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    db = get_mongo_db()
+    if source == "rollup":
+        results = rollup_summary(db, group_by, start, end)
+    else:
+        results = shipping_summary(db, group_by, start, end)
+
+    data = {"group_by": group_by, "source": source, "results": results}
+    if group_by == "service":
+        data["note"] = "Quotes saved without a UPS service code, such as bulk rows without a serviceType column, are grouped as \"unknown\"."
+    return Response(data, status=status.HTTP_200_OK)